@@ -1,47 +1,292 @@
+import os
+import tempfile
 import numpy as np
-from collections import deque
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 
-def region_growing_alg(image):
-    """Labels each part of image pixel by pixel
-    
-    Algorithm lables one connected component at a time
+# neighbor offsets (row, col) of each connectivity. The first half are the
+# neighbors a raster scan has already passed, the second half mirrors them
+NEIGHBOR_OFFSETS = {
+    4: [(-1, 0), (0, -1), (1, 0), (0, 1)],
+    6: [(-1, -1), (-1, 0), (0, -1), (1, 1), (1, 0), (0, 1)],
+    8: [(-1, -1), (-1, 0), (-1, 1), (0, -1), (1, 1), (1, 0), (1, -1), (0, 1)],
+}
+
+def neighbor_offsets(connectivity, scanned=False):
+    """Looks up the neighbor offsets of a connectivity
+
+    Parameters
+    * connectivity (int) - 4, 6 (pos B, C, D and their mirrors) or 8
+    * scanned (bool) - only the neighbors a raster scan has already passed
+    """
+    if connectivity not in NEIGHBOR_OFFSETS:
+        raise ValueError(f"connectivity must be 4, 6 or 8, not {connectivity}")
+    offsets = NEIGHBOR_OFFSETS[connectivity]
+    return offsets[:len(offsets) // 2] if scanned else offsets
+
+def above_reach(connectivity):
+    """Columns of the row above a pixel touches, relative to its own column
+
+    Parameters
+    * connectivity (int) - 4, 6 or 8, see neighbor_offsets
+
+    Returns
+    * lo, hi (int) - first and last column offset, every column in between
+      is touched too
     """
+    above = [dj for di, dj in neighbor_offsets(connectivity, scanned=True) if di == -1]
+    return min(above), max(above)
+
+def _padded_foreground(image):
+    """Flat foreground mask of image with a border of background around it
+
+    Neighbors of any pixel are at fixed linear offsets (di * (W + 2) + dj) so
+    nothing needs a bounds check
+    """
+    n, m = image.shape
+    padded = np.zeros((n + 2) * (m + 2), dtype=bool)
+    padded.reshape(n + 2, m + 2)[1:-1, 1:-1] = image == 1
+    return padded
+
+def label_dtype(max_label, dtype=None):
+    """Picks the dtype of a label map
+
+    Parameters
+    * max_label (int) - largest label the map has to hold
+    * dtype (dtype) - explicit dtype, otherwise uint16 when max_label fits and
+      uint32 when it doesn't
+
+    Raises OverflowError when max_label doesn't fit the dtype
+    """
+    if dtype is None:
+        dtype = np.uint16 if max_label <= np.iinfo(np.uint16).max else np.uint32
+    dtype = np.dtype(dtype)
+    if max_label > np.iinfo(dtype).max:
+        raise OverflowError(f"label {max_label} does not fit in {dtype}")
+    return dtype
+
+def _cast_labels(labeled, dtype=None):
+    """Converts a label map to label_dtype of its largest label"""
+    return labeled.astype(label_dtype(int(labeled.max(initial=0)), dtype), copy=False)
+
+def _hole_fill(labeled, connectivity=6):
+    """Label of the surrounding part for every hole pixel of labeled, else 0
+
+    Holes are the background parts not touching the border, labeled with the
+    dual of connectivity (4 and 8 swap, 6 is its own dual). The pixel left of
+    a hole's first pixel always belongs to the part around it
+    """
+    if not labeled.size:
+        return np.zeros_like(labeled)
+    background = labeled == 0
+    dual = 6 if connectivity == 6 else 12 - connectivity
+    _, holes = seq_label_alg(background, 'runs', True, dual)
+    size = int(holes.max()) + 1
+
+    is_hole = np.ones(size, dtype=bool)
+    is_hole[0] = False
+    for edge in (holes[0], holes[-1], holes[:, 0], holes[:, -1]):
+        is_hole[edge] = False
+    flat = holes.ravel()
+    pos = np.flatnonzero(flat)
+    first = np.full(size, flat.size)
+    np.minimum.at(first, flat[pos], pos)
+
+    fill = np.zeros(size, dtype=labeled.dtype)
+    fill[is_hole] = labeled.ravel()[first[is_hole] - 1]
+    return fill[holes]
+
+def _cleanup(labels, labeled, min_area=0, fill_holes=False, connectivity=6, compact=False):
+    """Drops parts smaller than min_area and fills holes of the rest
+
+    Areas come from one bincount and the labels are rewritten through one
+    lookup table, so it costs one extra pass (plus labeling the background
+    for fill_holes). Parts are dropped on their own area, before filling
+
+    Parameters
+    * labels (set) - labels of labeled
+    * labeled (ndarray) - label map with shape (H,W)
+    * min_area (int) - parts with fewer pixels become background
+    * fill_holes (bool) - background enclosed by a part joins it
+    * connectivity (int) - connectivity labeled was labeled with
+    * compact (bool) - renumbers the remaining labels to 1..K keeping order
+    """
+    lut = np.arange(int(labeled.max(initial=0)) + 1)
+    if min_area:
+        lut[np.bincount(labeled.ravel(), minlength=len(lut)) < min_area] = 0
+    if compact:
+        kept = lut > 0
+        lut[kept] = np.arange(1, np.count_nonzero(kept) + 1)
+    labeled = lut[labeled]
+    if fill_holes:
+        labeled += _hole_fill(labeled, connectivity)
+
+    remaining = set(lut[sorted(labels)].tolist())
+    if 0 not in labels:
+        remaining.discard(0)
+    return remaining, labeled
+
+def _region_grow_stack(image, connectivity=4):
+    """Labels each part of image with an explicit DFS stack
+
+    The stack is a preallocated int32 array of linear pixel positions in a
+    zero padded copy of the image, so neighbors never need bounds checks.
+    Pixels are marked visited when pushed, so the stack never holds more than
+    the foreground pixels and components of any size work without recursion
+    """
+    labels = set()
+    n, m = image.shape
+    w = m + 2
+    shifts = [di * w + dj for di, dj in neighbor_offsets(connectivity)]
+    # open means foreground and not visited yet
+    is_open = _padded_foreground(image)
+    padded_labels = np.zeros((n + 2) * w, dtype=np.int64)
+    stack = np.empty(np.count_nonzero(is_open), dtype=np.int32)
+
+    label = 0
+    for p in np.flatnonzero(is_open).tolist():
+        if not is_open[p]:
+            continue
+        label += 1
+        labels.add(label)
+
+        is_open[p] = False
+        stack[0] = p
+        top = 1
+        while top:
+            top -= 1
+            q = int(stack[top])
+            padded_labels[q] = label
+            for shift in shifts:
+                r = q + shift
+                if is_open[r]:
+                    is_open[r] = False
+                    stack[top] = r
+                    top += 1
+
+    return labels, padded_labels.reshape(n + 2, w)[1:-1, 1:-1]
+
+def _region_grow_recursive(image, connectivity=4):
+    """Labels each part of image with a recursive DFS"""
     labels = set()
-    labeled = np.zeros_like(image)
+    labeled = np.zeros(image.shape, dtype=np.int64)
     visited = set()
     n, m = image.shape
+    offsets = neighbor_offsets(connectivity)
+    # padded by one so every neighbor is in bounds, pos (i, j) is at (i+1, j+1)
+    foreground = _padded_foreground(image).reshape(n + 2, m + 2)
 
     def dfs(i, j, label):
         """ Labels all valid neighbors"""
         
-        labeled[i, j] = label
+        labeled[i - 1, j - 1] = label
         visited.add((i, j))
 
-        for x, y in [(i + 1 , j), (i , j + 1), (i - 1 , j), (i , j - 1)]:
-            if (0 <= x < n and 0 <= y < m and (x, y) not in visited 
-                and image[x, y] == 1):
+        for di, dj in offsets:
+            x, y = i + di, j + dj
+            if (x, y) not in visited and foreground[x, y]:
                 dfs(x, y, label)
 
     label = 0
     for i in range(n):
         for j in range(m):
-            if (i, j) not in visited and image[i, j] == 1:
+            if (i + 1, j + 1) not in visited and image[i, j] == 1:
                 label += 1
                 labels.add(label)
-                dfs(i, j, label)
+                dfs(i + 1, j + 1, label)
 
     return labels, labeled
 
-def region_grow_bfs(image): 
+def region_growing_alg(image, engine='recursive', connectivity=4, dtype=None, min_area=0,
+                       fill_holes=False):
     """Labels each part of image pixel by pixel
     
-    Algorithm lables one connected component at a time iteratively
+    Algorithm lables one connected component at a time
+
+    Parameters
+    * image (ndarray) - binary matrix with shape (H,W)
+    * engine (str) - 'recursive' recurses once per pixel and is limited by the
+      recursion limit, 'stack' runs the same DFS on an explicit stack
+    * connectivity (int) - 4, 6 or 8, see neighbor_offsets
+    * dtype (dtype) - dtype of the labels, see label_dtype
+    * min_area (int) - parts with fewer pixels are dropped, the rest are
+      renumbered 1..K
+    * fill_holes (bool) - fills background enclosed by a part with its label
+    """
+    if engine == 'stack':
+        labels, labeled = _region_grow_stack(image, connectivity)
+    elif engine == 'recursive':
+        labels, labeled = _region_grow_recursive(image, connectivity)
+    else:
+        raise ValueError(f"unknown engine '{engine}'")
+
+    if min_area or fill_holes:
+        labels, labeled = _cleanup(labels, labeled, min_area, fill_holes, connectivity, True)
+    return labels, _cast_labels(labeled, dtype)
+
+def _grow_unvisited(is_open, grow, labels):
+    """Calls grow(seed, label) on each pixel of is_open still open when reached
+
+    Labels go 1, 2, ... in raster order and are added to labels. Pixels are
+    checked in chunks so visited ones are skipped quickly
+    """
+    seeds = np.flatnonzero(is_open)
+    label = 0
+    pos = 0
+    while pos < len(seeds):
+        unvisited = is_open[seeds[pos:pos + 4096]]
+        if not unvisited.any():
+            pos += len(unvisited)
+            continue
+        pos += int(np.argmax(unvisited))
+        label += 1
+        labels.add(label)
+        grow(seeds[pos], label)
+
+def _region_grow_frontier(image, connectivity=4):
+    """Labels each part of image one BFS level at a time
+
+    The frontier is kept as an array of linear positions in a zero padded copy
+    of the image, so each level is a handful of NumPy operations instead of one
+    queue entry per pixel. Pays off on large components, masks of many tiny
+    specks are faster with the queue
     """
     labels = set()
-    labeled = np.zeros_like(image)
+    n, m = image.shape
+    w = m + 2
+    shifts = np.array([di * w + dj for di, dj in neighbor_offsets(connectivity)])
+    # open means foreground and not visited yet
+    is_open = _padded_foreground(image)
+    padded_labels = np.zeros((n + 2) * w, dtype=np.int64)
+
+    def bfs(seed, label):
+        """ Labels the component of seed, a whole frontier per step"""
+        is_open[seed] = False
+        padded_labels[seed] = label
+        frontier = np.array([seed])
+
+        while len(frontier):
+            neighbors = (frontier[:, None] + shifts).ravel()
+            # several frontier pixels can share a neighbor
+            fresh = np.unique(neighbors[is_open[neighbors]])
+            is_open[fresh] = False
+            padded_labels[fresh] = label
+            frontier = fresh
+
+    _grow_unvisited(is_open, bfs, labels)
+    return labels, padded_labels.reshape(n + 2, w)[1:-1, 1:-1]
+
+def _region_grow_queue(image, connectivity=4):
+    """Labels each part of image with a BFS queue of pixels"""
+    labels = set()
+    labeled = np.zeros(image.shape, dtype=np.int64)
     visited = set()
     n, m = image.shape
+    offsets = neighbor_offsets(connectivity)
+    # padded by one so every neighbor is in bounds, pos (i, j) is at (i+1, j+1)
+    foreground = _padded_foreground(image).reshape(n + 2, m + 2)
 
     def bfs(i, j, label):
         """ Labels all valid neighbors"""
@@ -51,11 +296,12 @@ def region_grow_bfs(image):
 
         while(queue):
             curr_i, curr_j = queue.popleft()
-            labeled[curr_i, curr_j] = label
+            labeled[curr_i - 1, curr_j - 1] = label
             visited.add((curr_i, curr_j)) # redundant but secure
 
-            for x, y in [(curr_i + 1 , curr_j), (curr_i , curr_j + 1), (curr_i - 1 , curr_j), (curr_i , curr_j - 1)]:
-                if (0 <= x < n and 0 <= y < m and (x, y) not in visited and image[x, y] == 1):
+            for di, dj in offsets:
+                x, y = curr_i + di, curr_j + dj
+                if (x, y) not in visited and foreground[x, y]:
                     visited.add((x, y)) # can't forget to add stuff before it goes into the queue!
                     queue.append((x, y))
 
@@ -63,96 +309,1420 @@ def region_grow_bfs(image):
     label = 0
     for i in range(n):
         for j in range(m):
-            if (i, j) not in visited and image[i, j] == 1:
+            if (i + 1, j + 1) not in visited and image[i, j] == 1:
                 label += 1
                 labels.add(label)
-                bfs(i, j, label)
+                bfs(i + 1, j + 1, label)
 
     return labels, labeled
 
-def seq_label_alg(image):
-    """ Labels each part of the image row by row
+def region_grow_bfs(image, engine='queue', connectivity=4, props=False, dtype=None,
+                    min_area=0, fill_holes=False):
+    """Labels each part of image pixel by pixel
+    
+    Algorithm lables one connected component at a time iteratively
 
-    Algorithm labels each pixel based on the labeling of it's neighbors (defined by 6-C)    
+    Parameters
+    * image (ndarray) - binary matrix with shape (H,W)
+    * engine (str) - 'queue' visits one pixel at a time, 'frontier' expands a
+      whole BFS level at once with a boolean visited mask, same output
+    * connectivity (int) - 4, 6 or 8, see neighbor_offsets
+    * props (bool) - also returns the statistics of every label, see regionprops
+    * dtype (dtype) - dtype of the labels, see label_dtype
+    * min_area (int) - parts with fewer pixels are dropped, the rest are
+      renumbered 1..K
+    * fill_holes (bool) - fills background enclosed by a part with its label
     """
-    labeled = np.zeros_like(image)
-    equiv_table = {0:0}
-    label = 1
-    n, m = image.shape
+    if engine == 'frontier':
+        labels, labeled = _region_grow_frontier(image, connectivity)
+    elif engine == 'queue':
+        labels, labeled = _region_grow_queue(image, connectivity)
+    else:
+        raise ValueError(f"unknown engine '{engine}'")
 
-    def valid_pos(i, j):
-        """Checks if indices are in bounds"""
-        return 0<=i<n and 0<=j<m
-    
-    def find(a):
-        """Finds parent of current label"""
-        if equiv_table[a] != a:
-            equiv_table[a] = find(equiv_table[a])
-        return equiv_table[a]
-    
-    def union(a, b):
-        """Merges two labels in equivalence table
-        
-        Assigns smallest label value as true parent
+    if min_area or fill_holes:
+        labels, labeled = _cleanup(labels, labeled, min_area, fill_holes, connectivity, True)
+    labeled = _cast_labels(labeled, dtype)
+    if props:
+        return labels, labeled, regionprops(labeled)
+    return labels, labeled
+
+def region_grow_threshold(image, tolerance, seeds=None, connectivity=4, dtype=None):
+    """Grows regions of similar intensity or color, one BFS level at a time
+
+    A neighbor joins a region when its distance to the pixel that reached it
+    is at most tolerance, the absolute difference for grayscale and the
+    euclidean distance of the channels for color. Works on the image as read
+    (e.g. cv2.imread), no thresholding to binary first. Like the frontier
+    engine of region_grow_bfs it pays off on large regions: without seeds, a
+    noisy or textured image breaks into many tiny regions and costs one grow
+    per region, seconds for a megapixel of noise
+
+    Parameters
+    * image (ndarray) - grayscale matrix with shape (H,W) or color image with
+      shape (H,W,C)
+    * tolerance (float) - largest distance between neighbors of a region
+    * seeds (list) - (row, col) of the seeds, seeds[i] grows label i + 1 and
+      pixels no seed reaches stay 0. A seed reached from an earlier seed
+      keeps the label of that region. Default None grows every pixel into a
+      region, labeled in raster order
+    * connectivity (int) - 4, 6 or 8, see neighbor_offsets
+    * dtype (dtype) - dtype of the labels, see label_dtype
+
+    Raises ValueError when a seed is outside the image
+    """
+    labels = set()
+    n, m = image.shape[:2]
+    if seeds is not None:
+        for i, j in seeds:
+            if not (0 <= i < n and 0 <= j < m):
+                raise ValueError(f"seed {(i, j)} is outside the image of shape {(n, m)}")
+    w = m + 2
+    shifts = np.array([di * w + dj for di, dj in neighbor_offsets(connectivity)])
+    # float keeps the differences of unsigned pixels from wrapping around
+    values = np.zeros(((n + 2) * w, 1 if image.ndim == 2 else image.shape[2]),
+                      dtype=np.result_type(image.dtype, np.float32))
+    values.reshape(n + 2, w, -1)[1:-1, 1:-1] = image.reshape(n, m, values.shape[1])
+    # open means inside the image and not visited yet
+    is_open = np.zeros((n + 2) * w, dtype=bool)
+    is_open.reshape(n + 2, w)[1:-1, 1:-1] = True
+    padded_labels = np.zeros((n + 2) * w, dtype=np.int64)
+    limit = tolerance ** 2
+
+    def grow(seed, label):
+        """ Labels the region of seed, a whole frontier per step"""
+        is_open[seed] = False
+        padded_labels[seed] = label
+        frontier = np.array([seed])
+
+        while len(frontier):
+            sources = np.repeat(frontier, len(shifts))
+            neighbors = (frontier[:, None] + shifts).ravel()
+            keep = is_open[neighbors]
+            sources, neighbors = sources[keep], neighbors[keep]
+            diff = values[neighbors] - values[sources]
+            near = np.einsum('ij,ij->i', diff, diff) <= limit
+            # several frontier pixels can share a neighbor
+            fresh = np.unique(neighbors[near])
+            is_open[fresh] = False
+            padded_labels[fresh] = label
+            frontier = fresh
+
+    if seeds is not None:
+        for label, (i, j) in enumerate(seeds, start=1):
+            seed = (i + 1) * w + j + 1
+            if is_open[seed]:
+                labels.add(label)
+                grow(seed, label)
+    else:
+        _grow_unvisited(is_open, grow, labels)
+
+    labeled = padded_labels.reshape(n + 2, w)[1:-1, 1:-1]
+    return labels, _cast_labels(labeled, dtype)
+
+class UnionFind():
+    """Equivalence table for provisional labels backed by an int32 parent array
+
+    The array is preallocated and doubles when it runs out of room. Unions
+    always make the smallest label the root, so parent[a] <= a holds for every
+    label and roots are the first label created in their set.
+
+    Parameters
+    * size (int) - number of singleton labels to start with (0..size-1)
+    * capacity (int) - number of labels to preallocate room for
+    """
+
+    def __init__(self, size=1, capacity=1024):
+        self.parent = np.arange(max(size, capacity), dtype=np.int32)
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def make_set(self):
+        """Adds a new singleton label and returns it"""
+        if self.size == len(self.parent):
+            grown = np.arange(2 * len(self.parent), dtype=np.int32)
+            grown[:self.size] = self.parent
+            self.parent = grown
+        label = self.size
+        self.size += 1
+        return label
+
+    def find(self, a):
+        """Finds root of label a, compressing the path on the way back"""
+        parent = self.parent
+        root = a
+        while parent[root] != root:
+            root = parent[root]
+        while parent[a] != root:
+            parent[a], a = root, parent[a]
+        return int(root)
+
+    def union(self, a, b):
+        """Merges the sets of a and b under the smaller root, returns that root"""
+        a_parent = self.find(a)
+        b_parent = self.find(b)
+        if a_parent < b_parent:
+            self.parent[b_parent] = a_parent
+            return a_parent
+        self.parent[a_parent] = b_parent
+        return b_parent
+
+    def union_many(self, a, b):
+        """Merges label a[k] with b[k] for every k
+
+        Vectorized: each round hooks the larger root of every pair that is
+        still split onto the smaller one and flattens, until no pair is split
         """
-        a_parent = find(a)
-        b_parent = find(b)
-        if a_parent == b_parent:
-            return
-        elif a_parent < b_parent:
-            equiv_table[b_parent] = a_parent
-            return
-        else:
-            equiv_table[a_parent] = b_parent
+        a, b = np.asarray(a), np.asarray(b)
+        while len(a):
+            parent = self.flatten()
+            a_parent, b_parent = parent[a], parent[b]
+            split = a_parent != b_parent
+            a, b = a[split], b[split]
+            a_parent, b_parent = a_parent[split], b_parent[split]
+            np.minimum.at(parent, np.maximum(a_parent, b_parent),
+                          np.minimum(a_parent, b_parent))
+
+    def flatten(self, compact=False):
+        """Points every label directly at its root
+
+        Pointer jumping halves every path per step, so this takes a handful of
+        vectorized passes. Returns a lookup table from label to root, or to the
+        rank of the root (0..K-1 in label order) when compact is set
+        """
+        parent = self.parent[:self.size]
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent[:] = grand
+
+        if not compact:
+            return parent
+        is_root = parent == np.arange(self.size)
+        return (np.cumsum(is_root, dtype=np.int32) - 1)[parent]
+
+def row_runs(image):
+    """Run-length encodes every row of a binary image
+
+    Parameters
+    * image (ndarray) - binary matrix with shape (H,W)
+
+    Returns
+    * rows, starts, ends (ndarray) - one entry per run of foreground pixels in
+      raster order, ends are exclusive
+    """
+    n, m = image.shape
+    padded = np.zeros((n, m + 2), dtype=np.int8)
+    padded[:, 1:-1] = image != 0
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return rows, starts, ends
+
+def _label_runs(image, compact=False, connectivity=6):
+    """ Labels each run of the image
+
+    Same scan as seq_label_alg but unions whole runs of a row at once. A run
+    only creates a new label when its first pixel would have (no labeled
+    neighbor in the row above) so the final labels match the pixel scan exactly
+
+    Returns
+    * rows, starts, ends (ndarray) - runs of the image, see row_runs
+    * run_labels (ndarray) - final label of each run
+    """
+    equiv_table = UnionFind()
+    rows, starts, ends = row_runs(image)
+    run_labels = np.zeros(len(rows), dtype=np.int32)
+    lo, hi = above_reach(connectivity)
+
+    # runs of the previous row, as [first, last) indices into the run arrays
+    prev_first = prev_last = 0
+    r = 0
+    while r < len(rows):
+        row = rows[r]
+        first = r
+        while r < len(rows) and rows[r] == row:
+            r += 1
+        if first == 0 or rows[first - 1] != row - 1:
+            prev_first = prev_last = first
+
+        k = prev_first
+        for run in range(first, r):
+            s, e = starts[run], ends[run]
+            # runs above that end before the first touched column can't touch
+            # this or later runs
+            while k < prev_last and ends[k] <= s + lo:
+                k += 1
+
+            # first pixel of the run copies a neighbor above, otherwise it's a new label
+            if k < prev_last and starts[k] <= s + hi:
+                run_labels[run] = run_labels[k]
+            else:
+                run_labels[run] = equiv_table.make_set()
+
+            overlap = k
+            while overlap < prev_last and starts[overlap] < e + hi:
+                equiv_table.union(run_labels[run], run_labels[overlap])
+                overlap += 1
+
+        prev_first, prev_last = first, r
+
+    # second pass to finalize labels, once per run instead of once per pixel
+    run_labels = equiv_table.flatten(compact)[run_labels]
+    return rows, starts, ends, run_labels
+
+def _paint_runs(labeled, rows, starts, ends, values):
+    """Writes one value per run into labeled, a (rows, W) array"""
+    lengths = ends - starts
+    first = np.cumsum(lengths) - lengths
+    flat = (np.arange(lengths.sum()) - np.repeat(first, lengths)
+            + np.repeat(rows.astype(np.int64) * labeled.shape[-1] + starts, lengths))
+    labeled.reshape(-1)[flat] = np.repeat(values, lengths)
+
+def _touching_runs(rows, starts, ends, m, target, lo, hi):
+    """Pairs runs with the runs they touch in another row, all at once
+
+    Run k touches the runs of row target[k] (-1 for none) that cover any column
+    from starts[k] + lo to ends[k] - 1 + hi. Runs are found by binary search on
+    keys row * (W + 1) + column, which sort the runs of every row together
+
+    Returns
+    * a, b (ndarray) - indices of touching runs, b[k] is the run in the target row
+    """
+    key = rows.astype(np.int64) * (m + 1)
+    target_key = target.astype(np.int64) * (m + 1)
+    first = np.searchsorted(key + ends, target_key + starts + lo, side='right')
+    last = np.searchsorted(key + starts, target_key + ends - 1 + hi, side='right')
+    count = np.where(target >= 0, np.maximum(last - first, 0), 0)
+
+    a = np.repeat(np.arange(len(rows)), count)
+    b = (np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+         + np.repeat(first, count))
+    return a, b
+
+REGION_PROPS_DTYPE = np.dtype([
+    ('area', np.int64),
+    ('bbox', np.int64, (4,)),         # min_row, min_col, max_row, max_col (exclusive)
+    ('centroid', np.float64, (2,)),   # row, col
+    ('moments', np.float64, (3,)),    # central mu20, mu11, mu02 divided by area
+])
+
+def _props_from_sums(area, sums, bbox):
+    """Fills a REGION_PROPS_DTYPE array from per label sums
+
+    sums are the per label sums of row, col, row^2, row*col and col^2
+    """
+    props = np.zeros(len(area), dtype=REGION_PROPS_DTYPE)
+    found = area > 0
+    props['area'] = area
+    props['bbox'][found] = bbox[found]
+    mean = np.zeros((len(area), 5))
+    mean[found] = sums[found] / area[found, None]
+    props['centroid'] = mean[:, :2]
+    props['moments'] = mean[:, 2:] - np.stack([
+        mean[:, 0] ** 2, mean[:, 0] * mean[:, 1], mean[:, 1] ** 2], axis=1)
+    return props
+
+def _run_props(rows, starts, ends, run_labels, size):
+    """Region statistics summed run by run instead of pixel by pixel
+
+    The column sums of a run have closed forms, so every statistic is one
+    weighted bincount over the runs
+    """
+    rows, starts, ends = (x.astype(np.float64) for x in (rows, starts, ends))
+    length = ends - starts
+    col = (starts + ends - 1) * length / 2
+    # sum of j^2 for j in [s, e) is S(e - 1) - S(s - 1) with S(k) = k(k+1)(2k+1)/6
+    col2 = ((ends - 1) * ends * (2 * ends - 1) - (starts - 1) * starts * (2 * starts - 1)) / 6
+    sums = np.stack([
+        np.bincount(run_labels, weights=w, minlength=size)
+        for w in (rows * length, col, rows ** 2 * length, rows * col, col2)], axis=1)
+    area = np.bincount(run_labels, weights=length, minlength=size).astype(np.int64)
+
+    bbox = np.zeros((size, 4), dtype=np.int64)
+    bbox[:, :2] = np.iinfo(np.int64).max
+    np.minimum.at(bbox[:, 0], run_labels, rows.astype(np.int64))
+    np.minimum.at(bbox[:, 1], run_labels, starts.astype(np.int64))
+    np.maximum.at(bbox[:, 2], run_labels, rows.astype(np.int64) + 1)
+    np.maximum.at(bbox[:, 3], run_labels, ends.astype(np.int64))
+    return _props_from_sums(area, sums, bbox)
+
+def regionprops(labeled, size=None):
+    """Statistics of every label of a labeled image in one pass
+
+    Parameters
+    * labeled (ndarray) - matrix with shape (H, W) where pos[i, j] = label
+    * size (int) - length of the result, defaults to the largest label + 1
+
+    Returns
+    * props (ndarray) - REGION_PROPS_DTYPE array indexed by label with area,
+      bbox, centroid and central second moments. Row 0 is left empty and
+      labels without pixels have area 0
+    """
+    rows, cols = np.nonzero(labeled)
+    label_of = labeled[rows, cols].astype(np.int64)
+    size = size or int(label_of.max(initial=0)) + 1
+    rows, cols = rows.astype(np.float64), cols.astype(np.float64)
+    sums = np.stack([
+        np.bincount(label_of, weights=w, minlength=size)
+        for w in (rows, cols, rows ** 2, rows * cols, cols ** 2)], axis=1)
+    area = np.bincount(label_of, minlength=size)
+
+    bbox = np.zeros((size, 4), dtype=np.int64)
+    bbox[:, :2] = np.iinfo(np.int64).max
+    np.minimum.at(bbox[:, 0], label_of, rows.astype(np.int64))
+    np.minimum.at(bbox[:, 1], label_of, cols.astype(np.int64))
+    np.maximum.at(bbox[:, 2], label_of, rows.astype(np.int64) + 1)
+    np.maximum.at(bbox[:, 3], label_of, cols.astype(np.int64) + 1)
+    return _props_from_sums(area, sums, bbox)
+
+def _merge_runs(rows, starts, ends, m, targets):
+    """Labels runs through the runs they touch in other rows, vectorized
+
+    Parameters
+    * rows, starts, ends (ndarray) - runs in raster order, see row_runs
+    * m (int) - width of the rows
+    * targets (list) - (target, lo, hi) for every neighbor row, see _touching_runs
+
+    Returns
+    * run_labels (ndarray) - label of each run, 1..K in raster order
+    """
+    # run k has label k + 1, 0 stays background
+    equiv_table = UnionFind(len(rows) + 1)
+    for target, lo, hi in targets:
+        a, b = _touching_runs(rows, starts, ends, m, target, lo, hi)
+        equiv_table.union_many(a + 1, b + 1)
+    return equiv_table.flatten(compact=True)[1:]
+
+def _seq_label_pixels(image, compact=False, connectivity=6):
+    """ Labels each part of the image pixel by pixel"""
+    equiv_table = UnionFind()
+    n, m = image.shape
+    scanned = neighbor_offsets(connectivity, scanned=True)
+    # padded with a row above and a column each side so every neighbor is in
+    # bounds, pos (i, j) is at (i+1, j+1)
+    padded = np.zeros((n + 1, m + 2), dtype=np.int64)
 
-        
     for i in range(n):
         for j in range(m):
             if image[i,j] != 0:
-                # check pos D
-                if valid_pos(i-1,j-1) and labeled[i-1, j-1]:
-                    labeled[i, j] = labeled[i-1, j-1]
-
-                # checks both pos B and pos C 
-                elif (valid_pos(i-1, j) and labeled[i-1, j] and
-                      valid_pos(i, j - 1) and labeled[i, j - 1]):
-                    labeled[i, j] = min(labeled[i-1, j], labeled[i, j-1])
-                    union(labeled[i-1, j], labeled[i, j-1])
-
-                # checks only pos B
-                elif valid_pos(i-1, j) and labeled[i-1, j]:
-                    labeled[i, j] = labeled[i-1, j]
-
-                # checks only pos C
-                elif valid_pos(i, j - 1) and labeled[i, j - 1]:
-                    labeled[i, j] = labeled[i, j - 1]
-                
+                neighbors = [padded[i + 1 + di, j + 1 + dj] for di, dj in scanned]
+                neighbors = [l for l in neighbors if l]
+
                 # creates new label
-                else:
-                    labeled[i, j] = label
-                    equiv_table[label] = label
-                    label += 1
+                if not neighbors:
+                    padded[i + 1, j + 1] = equiv_table.make_set()
+                    continue
 
-    # second pass to finalize labels
-    labels = set([0])
-    for i in range(n):
-        for j in range(m):
-            labeled[i, j] = find(labeled[i, j])
-            labels.add(labeled[i, j])
+                # copies a labeled neighbor and merges the others into it
+                label = neighbors[0]
+                for other in neighbors[1:]:
+                    label = equiv_table.union(label, other)
+                padded[i + 1, j + 1] = label
+
+    # second pass to finalize labels, every provisional label resolved at once
+    lut = equiv_table.flatten(compact)
+    labeled = lut[padded[1:, 1:-1]]
+    labels = set(lut.tolist())
 
     return labels, labeled
 
-def skeletonization(image):
-    '''Thins image using Zhang Suen's thinning algorithm
-    
+def _label_sparse(image, compact=False, connectivity=6):
+    """ Labels the foreground pixels of the image without scanning the rest
+
+    Pixels come from np.flatnonzero, so they are sorted by linear index and
+    each scanned neighbor is found with np.searchsorted. A pixel would have
+    created a label in the pixel scan when none of its scanned neighbors is
+    found, so counting those gives the exact labels of the pixel scan
+
+    Returns
+    * pixels (ndarray) - linear indices of the foreground pixels
+    * pixel_labels (ndarray) - final label of each of them
+    """
+    n, m = image.shape
+    pixels = np.flatnonzero(image)
+    rows, cols = np.divmod(pixels, m)
+    # node k is the k-th foreground pixel, so roots are each object's first pixel
+    equiv_table = UnionFind(len(pixels))
+    new_label = np.ones(len(pixels), dtype=bool)
+
+    for di, dj in neighbor_offsets(connectivity, scanned=True):
+        wanted = pixels + di * m + dj
+        found = np.minimum(np.searchsorted(pixels, wanted), len(pixels) - 1)
+        hit = ((rows + di >= 0) & (cols + dj >= 0) & (cols + dj < m)
+               & (pixels[found] == wanted))
+        new_label &= ~hit
+        equiv_table.union_many(np.flatnonzero(hit), found[hit])
+
+    if compact:
+        return pixels, equiv_table.flatten(compact=True) + 1
+    return pixels, np.cumsum(new_label)[equiv_table.flatten()]
+
+# below this share of foreground pixels the sparse engine beats the run scan
+# on blob-like masks (on speckle noise it wins at any density)
+SPARSE_DENSITY = 0.02
+
+def seq_label_alg(image, engine='pixel', compact=False, connectivity=6, props=False,
+                  dtype=None, min_area=0, fill_holes=False):
+    """ Labels each part of the image row by row
+
+    Algorithm labels each pixel based on the labeling of it's neighbors (defined by 6-C
+    unless another connectivity is given)
+
+    Parameters
+    * image (ndarray) - binary matrix with shape (H,W)
+    * engine (str) - 'pixel' scans pixel by pixel, 'runs' scans run-length
+      encoded rows, 'sparse' only visits foreground pixels and 'auto' picks
+      'sparse' or 'runs' from the density of the image (see SPARSE_DENSITY).
+      All of them give identical output
+    * compact (bool) - renumbers labels to 1..K in raster order of each
+      object's first pixel
+    * connectivity (int) - 4, 6 or 8, see neighbor_offsets
+    * props (bool) - also returns the statistics of every label, see
+      regionprops. The run engine sums them per run while labeling
+    * dtype (dtype) - dtype of the labels, see label_dtype
+    * min_area (int) - parts with fewer pixels are dropped, with compact the
+      rest are renumbered 1..K
+    * fill_holes (bool) - fills background enclosed by a part with its label
+    """
+    if min_area or fill_holes:
+        labels, labeled = seq_label_alg(image, engine, compact, connectivity)
+        labels, labeled = _cleanup(labels, labeled, min_area, fill_holes, connectivity, compact)
+        labeled = _cast_labels(labeled, dtype)
+        if props:
+            return labels, labeled, regionprops(labeled)
+        return labels, labeled
+
+    if engine == 'auto':
+        density = np.count_nonzero(image) / max(image.size, 1)
+        engine = 'sparse' if density < SPARSE_DENSITY else 'runs'
+
+    if engine == 'runs':
+        rows, starts, ends, run_labels = _label_runs(image, compact, connectivity)
+        labels = set([0]) | set(run_labels.tolist())
+        labeled = np.zeros(image.shape, dtype=label_dtype(max(labels), dtype))
+        _paint_runs(labeled, rows, starts, ends, run_labels)
+        if props:
+            return labels, labeled, _run_props(rows, starts, ends, run_labels, max(labels) + 1)
+    elif engine == 'sparse':
+        pixels, pixel_labels = _label_sparse(image, compact, connectivity)
+        labels = set([0]) | set(np.unique(pixel_labels).tolist())
+        labeled = np.zeros(image.shape, dtype=label_dtype(max(labels), dtype))
+        labeled.flat[pixels] = pixel_labels
+        if props:
+            return labels, labeled, regionprops(labeled)
+    elif engine == 'pixel':
+        labels, labeled = _seq_label_pixels(image, compact, connectivity)
+        labeled = _cast_labels(labeled, dtype)
+        if props:
+            return labels, labeled, regionprops(labeled)
+    else:
+        raise ValueError(f"unknown engine '{engine}'")
+
+    return labels, labeled
+
+def _block_decisions():
+    """Builds the decision table for block_label_alg
+
+    A 2x2 block X can only reach its already scanned neighbor blocks P (up
+    left), Q (up), R (up right) and S (left) through 10 pixels:
+
+        P_br | Q_bl Q_br | R_bl
+        -----+-----------+-----
+        S_tr |  o    p   |
+        S_br |  s    t   |
+
+    Bits of the code follow that order (P_br is bit 0, t is bit 9). Each entry
+    is the tuple of (row, col) block offsets X has to merge with, leaving out
+    neighbors that are already merged with each other through pixels that
+    touch, so most blocks need at most one union
+    """
+    table = []
+    for code in range(1024):
+        p_br, q_bl, q_br, r_bl, s_tr, s_br, o, p, s, t = (
+            (code >> bit) & 1 for bit in range(10))
+        if not (o or p or s or t):
+            table.append(())
+            continue
+
+        connected = {
+            'P': o and p_br,
+            'Q': (o or p) and (q_bl or q_br),
+            'R': p and r_bl,
+            'S': (o or s) and (s_tr or s_br),
+        }
+        # neighbor blocks that were merged when they were scanned
+        merged = [('P', 'Q', p_br and q_bl), ('Q', 'R', q_br and r_bl),
+                  ('P', 'S', p_br and s_tr), ('Q', 'S', q_bl and s_tr)]
+        groups = {name: name for name in connected if connected[name]}
+        for a, b, same in merged:
+            if same and a in groups and b in groups:
+                old, new = groups[b], groups[a]
+                groups = {k: new if v == old else v for k, v in groups.items()}
+
+        offsets = {'P': (-1, -1), 'Q': (-1, 0), 'R': (-1, 1), 'S': (0, -1)}
+        table.append(tuple(offsets[name] for name in sorted(set(groups.values()))))
+
+    return table
+
+_BLOCK_DECISIONS = _block_decisions()
+
+def block_label_alg(image, compact=False, dtype=None, min_area=0, fill_holes=False):
+    """ Labels each part of the image 2x2 block by 2x2 block (defined by 8-C)
+
+    Every foreground pixel in a 2x2 block is 8-connected to the others, so the
+    scan labels whole blocks. Which neighbor blocks to merge with comes from a
+    precomputed decision table (Grana et al. block based labeling) instead of
+    per pixel neighbor checks
+
     Parameters
     * image (ndarray) - binary matrix with shape (H,W)
+    * compact (bool) - renumbers labels to 1..K in block scan order
+    * dtype (dtype) - dtype of the labels, see label_dtype
+    * min_area (int) - parts with fewer pixels are dropped, with compact the
+      rest are renumbered 1..K
+    * fill_holes (bool) - fills background enclosed by a part with its label
 
     Returns
-    * frames (list) - a collection of iterations in thinning process
-    '''
+    * labels (set) - a set of all unique labels, including 0
+    * labeled (ndarray) - matrix with shape (H, W) where pos[i, j] = label
+    """
+    n, m = image.shape
+    bn, bm = (n + 1) // 2, (m + 1) // 2
+
+    # one row above and a column on each side so every block has all 10 pixels
+    padded = np.zeros((2 * bn + 1, 2 * bm + 2), dtype=np.int32)
+    padded[1:n + 1, 1:m + 1] = image != 0
+    pixels = [
+        padded[0:-1:2, 0:-2:2],   # P_br
+        padded[0:-1:2, 1:-1:2],   # Q_bl
+        padded[0:-1:2, 2::2],     # Q_br
+        padded[0:-1:2, 3::2],     # R_bl
+        padded[1::2, 0:-2:2],     # S_tr
+        padded[2::2, 0:-2:2],     # S_br
+        padded[1::2, 1:-1:2],     # o
+        padded[1::2, 2::2],       # p
+        padded[2::2, 1:-1:2],     # s
+        padded[2::2, 2::2],       # t
+    ]
+    codes = np.zeros((bn, bm), dtype=np.int32)
+    for bit, pixel in enumerate(pixels):
+        codes |= pixel << bit
+    foreground = (codes >> 6) != 0
+
+    # block labels with a border so offsets never leave the array
+    block_labels = np.zeros((bn + 1, bm + 2), dtype=np.int32)
+    equiv_table = UnionFind()
+    for r in range(bn):
+        for c in np.flatnonzero(foreground[r]).tolist():
+            decision = _BLOCK_DECISIONS[codes[r, c]]
+            if not decision:
+                block_labels[r + 1, c + 1] = equiv_table.make_set()
+                continue
+
+            dr, dc = decision[0]
+            label = block_labels[r + 1 + dr, c + 1 + dc]
+            for dr, dc in decision[1:]:
+                label = equiv_table.union(label, block_labels[r + 1 + dr, c + 1 + dc])
+            block_labels[r + 1, c + 1] = label
+
+    lut = equiv_table.flatten(compact)
+    pixel_labels = lut[block_labels[1:, 1:-1]].repeat(2, axis=0).repeat(2, axis=1)
+    labels = set(lut.tolist())
+    labeled = np.where(image != 0, pixel_labels[:n, :m], 0)
+    if min_area or fill_holes:
+        labels, labeled = _cleanup(labels, labeled, min_area, fill_holes, 8, compact)
+    labeled = labeled.astype(label_dtype(max(labels), dtype))
+
+    return labels, labeled
+
+def _seam_pairs(line, edge, shifts):
+    """Finds the labels that touch across a seam
+
+    line and edge are aligned label rows (or columns) on either side of the
+    seam, and edge[k] touches line[k + d] for every d in shifts
+
+    Returns
+    * a, b (ndarray) - pairs of nonzero labels with a[k] touching b[k]
+    """
+    a, b = [], []
+    for d in shifts:
+        if d < 0:
+            a.append(line[:d])
+            b.append(edge[-d:])
+        else:
+            a.append(line[d:])
+            b.append(edge[:len(edge) - d])
+    a, b = np.concatenate(a), np.concatenate(b)
+    touching = (a != 0) & (b != 0)
+    return a[touching], b[touching]
+
+def volume_offsets(connectivity, scanned=False):
+    """Neighbor offsets (depth, row, col) of a voxel
+
+    Parameters
+    * connectivity (int) - 6 (faces), 18 (faces and edges) or 26 (all)
+    * scanned (bool) - only the neighbors a raster scan has already passed
+    """
+    if connectivity not in (6, 18, 26):
+        raise ValueError(f"connectivity must be 6, 18 or 26, not {connectivity}")
+    steps = (-1, 0, 1)
+    offsets = [(dd, dh, dw) for dd in steps for dh in steps for dw in steps
+               if 0 < abs(dd) + abs(dh) + abs(dw) <= {6: 1, 18: 2, 26: 3}[connectivity]]
+    return offsets[:len(offsets) // 2] if scanned else offsets
+
+def volume_label_alg(volume, connectivity=26, dtype=None):
+    """ Labels each part of a binary volume (D, H, W) in 3D
+
+    Rows along the last axis are run-length encoded and every run is paired
+    with the runs it touches in the already scanned neighbor rows with binary
+    searches, so all of it is vectorized per neighbor row and the runs are
+    merged with UnionFind.union_many. There is no Python work per voxel or run
 
-    frames = []
+    Parameters
+    * volume (ndarray) - binary array with shape (D,H,W)
+    * connectivity (int) - 6, 18 or 26, see volume_offsets
+    * dtype (dtype) - dtype of the labels, see label_dtype
+
+    Returns
+    * labels (set) - a set of all unique labels, including 0
+    * labeled (ndarray) - array with shape (D,H,W), labels 1..K in raster order
+    """
+    d, n, m = volume.shape
+    rows, starts, ends = row_runs(volume.reshape(d * n, m))
+    depth, row = np.divmod(rows, n)
+
+    # neighbor rows with the range of columns each one reaches
+    reach = {}
+    for dd, dh, dw in volume_offsets(connectivity, scanned=True):
+        if (dd, dh) != (0, 0):
+            lo, hi = reach.get((dd, dh), (dw, dw))
+            reach[(dd, dh)] = min(lo, dw), max(hi, dw)
+
+    targets = []
+    for (dd, dh), (lo, hi) in reach.items():
+        valid = (depth + dd >= 0) & (row + dh >= 0) & (row + dh < n)
+        targets.append((np.where(valid, rows + dd * n + dh, -1), lo, hi))
+
+    run_labels = _merge_runs(rows, starts, ends, m, targets)
+    labels = set([0]) | set(run_labels.tolist())
+    labeled = np.zeros(volume.shape, dtype=label_dtype(max(labels), dtype))
+    _paint_runs(labeled.reshape(d * n, m), rows, starts, ends, run_labels)
+
+    return labels, labeled
+
+Component = namedtuple('Component', ['label', 'area', 'bbox', 'runs'])
+Component.__doc__ = """Connected component emitted by stream_label_alg
+
+* label (int) - labels count up in the order components are completed
+* area (int) - number of pixels
+* bbox (tuple) - (min_row, min_col, max_row, max_col), max exclusive
+* runs (ndarray) - int32 array of (row, start, end) runs, end exclusive
+"""
+
+def batch_label_alg(images, connectivity=6, dtype=None):
+    """ Labels a stack of binary images (N, H, W) in one call
+
+    The stack is scanned as one tall image of N * H rows, except that the
+    first row of a frame never looks at the row above it, so labels can't
+    cross frames. Everything runs vectorized over all frames together, so the
+    cost follows the number of pixels rather than the number of frames
+
+    Parameters
+    * images (ndarray) - binary array with shape (N,H,W)
+    * connectivity (int) - 4, 6 or 8, see neighbor_offsets
+    * dtype (dtype) - dtype of the labels, see label_dtype
+
+    Returns
+    * labeled (ndarray) - array with shape (N,H,W), labels 1..K of every frame
+      in raster order
+    * counts (ndarray) - number of labels K of every frame
+    """
+    f, n, m = images.shape
+    lo, hi = above_reach(connectivity)
+    rows, starts, ends = row_runs(images.reshape(f * n, m))
+    frame = rows // n
+
+    target = np.where(rows % n != 0, rows - 1, -1)
+    run_labels = _merge_runs(rows, starts, ends, m, [(target, lo, hi)])
+
+    # labels are in raster order, so each frame holds a consecutive block of them
+    counts = np.zeros(f, dtype=np.int64)
+    np.maximum.at(counts, frame, run_labels)
+    offsets = np.concatenate([[0], np.maximum.accumulate(counts)[:-1]])
+    counts = np.maximum(counts - offsets, 0)
+
+    labeled = np.zeros(images.shape, dtype=label_dtype(int(counts.max(initial=0)), dtype))
+    _paint_runs(labeled.reshape(f * n, m), rows, starts, ends, run_labels - offsets[frame])
+
+    return labeled, counts
+
+def stream_label_alg(rows, connectivity=6):
+    """ Labels a mask arriving one row at a time, yields finished components
+
+    Only the runs of the previous row are kept, each pointing at the component
+    it belongs to. A component is finished as soon as a row doesn't touch it
+    since no later row can reach it anymore, so it's yielded right away
+
+    Parameters
+    * rows (iterable) - binary rows of the same width, e.g. lines from a camera
+    * connectivity (int) - 4, 6 or 8, see neighbor_offsets
+
+    Yields
+    * component (Component) - area, bounding box and runs of a finished component
+    """
+    lo, hi = above_reach(connectivity)
+    # id -> [area, min_row, min_col, max_row, max_col, runs]
+    active = {}
+    merged = {}
+    prev = []
+    next_id = 0
+    label = 0
+
+    def find(a):
+        """Follows merges made during the current row"""
+        while a in merged:
+            a = merged[a]
+        return a
+
+    def emit(ids):
+        """Yields the given components in the order they were started"""
+        nonlocal label
+        for a in sorted(ids):
+            area, r0, c0, r1, c1, runs = active.pop(a)
+            label += 1
+            yield Component(label, area, (r0, c0, r1 + 1, c1 + 1),
+                            np.array(runs, dtype=np.int32).reshape(-1, 3))
+
+    i = -1
+    for i, row in enumerate(rows):
+        _, starts, ends = row_runs(np.asarray(row).reshape(1, -1))
+        cur = []
+        k = 0
+        for s, e in zip(starts.tolist(), ends.tolist()):
+            while k < len(prev) and prev[k][1] <= s + lo:
+                k += 1
+            touching = set()
+            overlap = k
+            while overlap < len(prev) and prev[overlap][0] < e + hi:
+                touching.add(find(prev[overlap][2]))
+                overlap += 1
+
+            if not touching:
+                comp = next_id
+                next_id += 1
+                active[comp] = [0, i, s, i, e - 1, []]
+            else:
+                # everything merges into the component with the most runs
+                comp = max(touching, key=lambda a: len(active[a][5]))
+                for other in touching - {comp}:
+                    area, r0, c0, r1, c1, runs = active.pop(other)
+                    state = active[comp]
+                    state[0] += area
+                    state[1:5] = (min(state[1], r0), min(state[2], c0),
+                                  max(state[3], r1), max(state[4], c1))
+                    state[5].extend(runs)
+                    merged[other] = comp
+
+            state = active[comp]
+            state[0] += e - s
+            state[2], state[3], state[4] = min(state[2], s), i, max(state[4], e - 1)
+            state[5].append((i, s, e))
+            cur.append((s, e, comp))
+
+        cur = [(s, e, find(comp)) for s, e, comp in cur]
+        merged.clear()
+        touched = {comp for _, _, comp in cur}
+        yield from emit({comp for comp in active if comp not in touched})
+        prev = cur
+
+    yield from emit(set(active))
+
+class IncrementalLabeler():
+    """Keeps the labels of a mask up to date while it's edited in small strokes
+
+    Labels and the region statistics of every label (see regionprops) are kept
+    between edits. An edit only relabels its rectangle plus the bounding boxes
+    of the components touching it, so splits and merges come out right and
+    the cost follows the stroke and the objects it touches, not the image.
+    Labels that disappear are reused by later components
+
+    Parameters
+    * image (ndarray) - binary matrix with shape (H,W), copied
+    * connectivity (int) - 4, 6 or 8, see neighbor_offsets
+    """
+
+    def __init__(self, image, connectivity=6):
+        self.connectivity = connectivity
+        self.mask = image != 0
+        rows, starts, ends, run_labels = _label_runs(self.mask, True, connectivity)
+        self.labeled = np.zeros(self.mask.shape, dtype=np.int32)
+        _paint_runs(self.labeled, rows, starts, ends, run_labels)
+        self.props = _run_props(rows, starts, ends, run_labels, int(run_labels.max(initial=0)) + 1)
+
+    @property
+    def labels(self):
+        """Set of all current labels, including 0"""
+        return set([0]) | set(np.flatnonzero(self.props['area']).tolist())
+
+    def update(self, r0, r1, c0, c1, values=None):
+        """Relabels after the mask changed within rows r0..r1 and cols c0..c1
+
+        Parameters
+        * r0, r1, c0, c1 (int) - dirty rectangle, r1 and c1 exclusive
+        * values (ndarray) - new mask values of the rectangle, leave out if
+          self.mask was already edited in place
+        """
+        n, m = self.mask.shape
+        if values is not None:
+            self.mask[r0:r1, c0:c1] = np.asarray(values) != 0
+
+        # every component within one pixel of the rectangle may split or merge
+        ring = self.labeled[max(r0 - 1, 0):r1 + 1, max(c0 - 1, 0):c1 + 1]
+        affected = np.unique(ring)
+        affected = affected[affected != 0]
+        boxes = self.props['bbox'][affected]
+        br0, bc0 = min([r0, *boxes[:, 0]]), min([c0, *boxes[:, 1]])
+        br1, bc1 = max([r1, *boxes[:, 2]]), max([c1, *boxes[:, 3]])
+
+        old = self.labeled[br0:br1, bc0:bc1]
+        dirty = np.zeros(old.shape, dtype=bool)
+        dirty[r0 - br0:r1 - br0, c0 - bc0:c1 - bc0] = True
+        owned = np.isin(old, affected)
+        region = self.mask[br0:br1, bc0:bc1] & (owned | dirty)
+        old[owned] = 0
+        self.props[affected] = 0
+
+        rows, starts, ends, run_labels = _label_runs(region, True, self.connectivity)
+        count = int(run_labels.max(initial=0))
+        # free labels first, new ones past the end after that
+        free = np.flatnonzero(self.props['area'][1:] == 0) + 1
+        new = np.arange(len(self.props), len(self.props) + max(count - len(free), 0))
+        ids = np.concatenate([free[:count], new]).astype(np.int32)
+        if len(new):
+            self.props = np.concatenate(
+                [self.props, np.zeros(len(new), dtype=REGION_PROPS_DTYPE)])
+
+        local = np.zeros(old.shape, dtype=np.int32)
+        _paint_runs(local, rows, starts, ends, run_labels)
+        old[local != 0] = ids[local[local != 0] - 1]
+        self.props[ids] = _run_props(rows + br0, starts + bc0, ends + bc0, run_labels, count + 1)[1:]
+        return set(ids.tolist())
+
+class ComponentTracker():
+    """Gives the components of consecutive labeled frames persistent ids
+
+    Overlaps between the labels of two frames are counted sparsely with one
+    np.unique over paired label codes, so matching is linear in pixels no
+    matter how many objects there are. A component keeps the id of the
+    previous component it overlaps most when that component also overlaps it
+    most, every other component gets a new id
+
+    Events are (kind, parents, children) tuples of ids, kind being one of
+    * 'birth' - no parents, one child
+    * 'death' - one parent, no children
+    * 'split' - one parent overlapping several children
+    * 'merge' - several parents overlapping one child
+    """
+
+    def __init__(self):
+        self.previous = None
+        self.ids = np.zeros(1, dtype=np.int64)
+        self.next_id = 1
+
+    def update(self, labeled):
+        """Matches a labeled frame against the previous one
+
+        Parameters
+        * labeled (ndarray) - matrix with shape (H, W) where pos[i, j] = label,
+          from any of the labelers
+
+        Returns
+        * ids (ndarray) - persistent id of every label of the frame, indexed
+          by label, 0 for labels that aren't in the frame
+        * events (list) - births, deaths, splits and merges, see ComponentTracker
+        """
+        labeled = np.asarray(labeled)
+        current = np.unique(labeled)
+        current = current[current != 0].astype(np.int64)
+        size = int(current.max(initial=0)) + 1
+        previous = self.previous if self.previous is not None else np.zeros_like(labeled)
+        before = np.flatnonzero(self.ids)
+
+        both = (previous != 0) & (labeled != 0)
+        codes = previous[both].astype(np.int64) * size + labeled[both]
+        codes, overlap = np.unique(codes, return_counts=True)
+        parent, child = np.divmod(codes, size)
+
+        # best partner of every label, most overlap first
+        order = np.lexsort((-overlap, parent))
+        best_child = dict(zip(parent[order][::-1].tolist(), child[order][::-1].tolist()))
+        order = np.lexsort((-overlap, child))
+        best_parent = dict(zip(child[order][::-1].tolist(), parent[order][::-1].tolist()))
+
+        ids = np.zeros(size, dtype=np.int64)
+        events = []
+        for c in current.tolist():
+            p = best_parent.get(c)
+            if p is not None and best_child[p] == c:
+                ids[c] = self.ids[p]
+            else:
+                ids[c] = self.next_id
+                self.next_id += 1
+                if p is None:
+                    events.append(('birth', [], [int(ids[c])]))
+
+        parents_of = {}
+        children_of = {}
+        for p, c in zip(parent.tolist(), child.tolist()):
+            parents_of.setdefault(c, []).append(int(self.ids[p]))
+            children_of.setdefault(p, []).append(int(ids[c]))
+        for p in before.tolist():
+            if p not in children_of:
+                events.append(('death', [int(self.ids[p])], []))
+            elif len(children_of[p]) > 1:
+                events.append(('split', [int(self.ids[p])], children_of[p]))
+        for c, parents in parents_of.items():
+            if len(parents) > 1:
+                events.append(('merge', parents, [int(ids[c])]))
+
+        self.previous = labeled.copy()
+        self.ids = ids
+        return ids, events
+
+# bits set in every byte value, for popcounts on numpy versions without bitwise_count
+_BYTE_BITS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+class PackedMask():
+    """Binary mask packed one bit per pixel into uint64 words
+
+    Column j of row i is bit j % 64 of words[i, j // 64], bits past the width
+    are always 0. Boolean algebra, shifts, counting and run extraction all work
+    on whole words, so a mask takes 64x less memory than an int64 one
+
+    Parameters
+    * words (ndarray) - little endian uint64 array with shape (H, ceil(W / 64))
+    * width (int) - number of columns W
+    """
+
+    def __init__(self, words, width):
+        self.words = np.asarray(words, dtype='<u8')
+        self.width = width
+
+    @classmethod
+    def from_dense(cls, image):
+        """Packs a binary matrix with shape (H,W)"""
+        n, m = image.shape
+        packed = np.packbits(image != 0, axis=1, bitorder='little')
+        padded = np.zeros((n, 8 * ((m + 63) // 64)), dtype=np.uint8)
+        padded[:, :packed.shape[1]] = packed
+        return cls(padded.view('<u8'), m)
+
+    def to_dense(self):
+        """Unpacks to a bool matrix with shape (H,W)"""
+        n = len(self.words)
+        unpacked = np.unpackbits(self.words.view(np.uint8).reshape(n, 8 * self.words.shape[1]), axis=1,
+                                 count=self.width, bitorder='little')
+        return unpacked.astype(bool)
+
+    @property
+    def shape(self):
+        return len(self.words), self.width
+
+    def _tail(self):
+        """Mask of the valid bits of the last word of a row"""
+        bits = self.width % 64
+        return np.uint64(2 ** bits - 1 if bits else 2 ** 64 - 1)
+
+    def count(self):
+        """Number of foreground pixels"""
+        if hasattr(np, 'bitwise_count'):
+            return int(np.bitwise_count(self.words).sum())
+        return int(_BYTE_BITS[self.words.view(np.uint8)].sum())
+
+    def __and__(self, other):
+        return PackedMask(self.words & other.words, self.width)
+
+    def __or__(self, other):
+        return PackedMask(self.words | other.words, self.width)
+
+    def __xor__(self, other):
+        return PackedMask(self.words ^ other.words, self.width)
+
+    def __invert__(self):
+        words = ~self.words
+        if words.size:
+            words[:, -1] &= self._tail()
+        return PackedMask(words, self.width)
+
+    def shift(self, dy, dx):
+        """Moves every pixel down by dy and right by dx, filling with 0
+
+        Columns move whole words first and the remaining bits carry across
+        neighboring words, so (dy, dx) in neighbor_offsets gives neighbor masks
+        """
+        n, nw = self.words.shape
+        rows = np.zeros_like(self.words)
+        if abs(dy) < n:
+            rows[max(dy, 0):n + min(dy, 0)] = self.words[max(-dy, 0):n - max(dy, 0)]
+
+        q, r = divmod(abs(dx), 64)
+        words = np.zeros_like(self.words)
+        if q < nw:
+            # spread is the (nw + 1) words a pixel can end up in after the word shift
+            spread = np.zeros((n, nw + 1), dtype='<u8')
+            if dx >= 0:
+                spread[:, q + 1:] = rows[:, :nw - q]
+                words = spread[:, 1:] << np.uint64(r)
+                if r:
+                    words |= spread[:, :-1] >> np.uint64(64 - r)
+            else:
+                spread[:, :nw - q] = rows[:, q:]
+                words = spread[:, :-1] >> np.uint64(r)
+                if r:
+                    words |= spread[:, 1:] << np.uint64(64 - r)
+        if words.size:
+            words[:, -1] &= self._tail()
+        return PackedMask(words, self.width)
+
+    def runs(self):
+        """Run-length encodes every row straight from the words
+
+        Starts are set bits whose left neighbor isn't set, with the top bit of
+        the previous word carried in, and ends the same from the right. Only
+        words holding a start or an end get unpacked
+
+        Returns
+        * rows, starts, ends (ndarray) - same as row_runs
+        """
+        x = self.words
+        one, top = np.uint64(1), np.uint64(63)
+        carry_in = np.zeros_like(x)
+        carry_in[:, 1:] = x[:, :-1] >> top
+        carry_out = np.zeros_like(x)
+        carry_out[:, :-1] = x[:, 1:] << top
+        first = x & ~((x << one) | carry_in)
+        last = x & ~((x >> one) | carry_out)
+
+        def positions(words):
+            """(row, col) of every set bit, in raster order"""
+            rows, cols = np.nonzero(words)
+            bits = np.unpackbits(words[rows, cols].view(np.uint8).reshape(-1, 8),
+                                 axis=1, bitorder='little')
+            index, bit = np.nonzero(bits)
+            return rows[index], cols[index] * 64 + bit
+
+        rows, starts = positions(first)
+        _, ends = positions(last)
+        return rows, starts, ends + 1
+
+    def label(self, connectivity=6, dtype=None):
+        """Labels the mask from its runs, see seq_label_alg
+
+        Returns
+        * labels (set) - a set of all unique labels, including 0
+        * labeled (ndarray) - matrix with shape (H, W), labels 1..K in raster order
+        """
+        lo, hi = above_reach(connectivity)
+        rows, starts, ends = self.runs()
+        target = np.where(rows > 0, rows - 1, -1)
+        run_labels = _merge_runs(rows, starts, ends, self.width, [(target, lo, hi)])
+        labels = set([0]) | set(run_labels.tolist())
+        labeled = np.zeros(self.shape, dtype=label_dtype(max(labels), dtype))
+        _paint_runs(labeled, rows, starts, ends, run_labels)
+        return labels, labeled
+
+def _attach(name, shape, dtype):
+    """Maps a shared memory block as an array, returns (block, array)"""
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def _label_stripe(image_name, labeled_name, shape, r0, r1, connectivity):
+    """Labels rows r0..r1 of the shared image into the shared label array
+
+    Labels are local to the stripe (1..k). Returns k
+    """
+    image_shm, image = _attach(image_name, shape, np.uint8)
+    labeled_shm, labeled = _attach(labeled_name, shape, np.int32)
+    try:
+        rows, starts, ends, run_labels = _label_runs(image[r0:r1], True, connectivity)
+        _paint_runs(labeled[r0:r1], rows, starts, ends, run_labels)
+        return int(run_labels.max(initial=0))
+    finally:
+        del image, labeled
+        image_shm.close()
+        labeled_shm.close()
+
+def _relabel_stripe(labeled_name, lut_name, shape, lut_size, r0, r1, offset):
+    """Maps stripe labels through the shared global lookup table in place"""
+    labeled_shm, labeled = _attach(labeled_name, shape, np.int32)
+    lut_shm, lut = _attach(lut_name, (lut_size,), np.int32)
+    try:
+        labeled[r0:r1] = lut[np.where(labeled[r0:r1] != 0, labeled[r0:r1] + offset, 0)]
+    finally:
+        del labeled, lut
+        labeled_shm.close()
+        lut_shm.close()
+
+def parallel_label_alg(image, workers=None, connectivity=6, dtype=None):
+    """ Labels each part of the image in horizontal stripes across processes
+
+    Each worker labels one stripe with the run scan of seq_label_alg straight
+    from and into shared memory, so no array is pickled. The stripes are then
+    stitched with one union-find pass over the seam rows and relabeled in
+    parallel. Labels are compact (1..K in raster order), the same as
+    seq_label_alg(image, compact=True)
+
+    Parameters
+    * image (ndarray) - binary matrix with shape (H,W)
+    * workers (int) - number of processes, defaults to the number of cpus
+    * connectivity (int) - 4, 6 or 8, see neighbor_offsets
+    * dtype (dtype) - dtype of the labels, see label_dtype
+
+    Returns
+    * labels (set) - a set of all unique labels, including 0
+    * labeled (ndarray) - matrix with shape (H, W) where pos[i, j] = label
+    """
+    n, m = image.shape
+    lo, hi = above_reach(connectivity)
+    if not n:
+        return set([0]), np.zeros((n, m), dtype=label_dtype(0, dtype))
+    workers = workers or os.cpu_count()
+    bounds = np.linspace(0, n, min(workers, n) + 1).astype(int)
+    stripes = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    blocks = []
+    shared_image = shared_labeled = None
+    try:
+        image_shm = shared_memory.SharedMemory(create=True, size=max(n * m, 1))
+        blocks.append(image_shm)
+        shared_image = np.ndarray((n, m), dtype=np.uint8, buffer=image_shm.buf)
+        shared_image[...] = image != 0
+        labeled_shm = shared_memory.SharedMemory(create=True, size=max(4 * n * m, 1))
+        blocks.append(labeled_shm)
+        shared_labeled = np.ndarray((n, m), dtype=np.int32, buffer=labeled_shm.buf)
+        shared_labeled[...] = 0
+
+        with ProcessPoolExecutor(max_workers=len(stripes)) as pool:
+            counts = list(pool.map(_label_stripe, *zip(*[
+                (image_shm.name, labeled_shm.name, (n, m), r0, r1, connectivity)
+                for r0, r1 in stripes])))
+            offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+            # stitch every seam between a stripe's first row and the row above
+            equiv_table = UnionFind(int(sum(counts)) + 1)
+            for (r0, _), offset, prev_offset in zip(stripes[1:], offsets[1:], offsets):
+                upper = shared_labeled[r0 - 1]
+                lower = shared_labeled[r0]
+                upper = np.where(upper != 0, upper + prev_offset, 0)
+                lower = np.where(lower != 0, lower + offset, 0)
+                equiv_table.union_many(*_seam_pairs(upper, lower, range(lo, hi + 1)))
+
+            lut = equiv_table.flatten(compact=True)
+            lut_shm = shared_memory.SharedMemory(create=True, size=4 * len(lut))
+            blocks.append(lut_shm)
+            np.ndarray(lut.shape, dtype=np.int32, buffer=lut_shm.buf)[...] = lut
+            list(pool.map(_relabel_stripe, *zip(*[
+                (labeled_shm.name, lut_shm.name, (n, m), len(lut), r0, r1, offset)
+                for (r0, r1), offset in zip(stripes, offsets.tolist())])))
+
+        labeled = shared_labeled.astype(label_dtype(int(lut.max(initial=0)), dtype))
+    finally:
+        # views have to go before their blocks can be closed
+        shared_image = shared_labeled = None
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    labels = set(lut.tolist())
+    return labels, labeled
+
+def tiled_label_alg(image, out=None, tile=(1024, 1024), connectivity=6, dtype=None):
+    """ Labels each part of a memory-mapped image one tile at a time
+
+    Tiles are labeled with the run scan of seq_label_alg. The first pass only
+    keeps the labels of the last row and column it labeled, so objects that
+    cross a tile edge are merged through an equivalence table holding only
+    the labels found on tile edges. Once the final count is known, a second
+    pass labels every tile again and writes the merged labels to a
+    memory-mapped label map. Only a couple of tiles are in memory at once,
+    whatever the size of the image
+
+    Parameters
+    * image (ndarray or str) - binary matrix with shape (H,W), usually a
+      np.memmap, or the path of a .npy file which is opened memory-mapped
+    * out (ndarray or str) - label array with shape (H,W) or the path of the
+      .npy file to create, defaults to a temporary file. A file created here
+      is removed when labeling fails, otherwise the caller owns it and should
+      remove labeled.filename when done
+    * tile (tuple) - (rows, cols) of a tile
+    * connectivity (int) - 4, 6 or 8, see neighbor_offsets
+    * dtype (dtype) - dtype of a new out file, see label_dtype. Raises
+      OverflowError before anything is written when the labels don't fit it
+      or the dtype of out
+
+    Returns
+    * labels (set) - a set of all unique labels, including 0
+    * labeled (ndarray) - the out label map, labels 1..K in tile scan order
+    """
+    if isinstance(image, (str, os.PathLike)):
+        image = np.load(image, mmap_mode='r')
+    n, m = image.shape
+    lo, hi = above_reach(connectivity)
+    left = [di for di, dj in neighbor_offsets(connectivity) if dj == -1]
+    th, tw = tile
+    tiles = [(r0, min(r0 + th, n), c0, min(c0 + tw, m))
+             for r0 in range(0, n, th) for c0 in range(0, m, tw)]
+
+    seams = [np.zeros((0, 2), dtype=np.int64)]
+
+    def stitch(a, b):
+        """Keeps the distinct pairs of labels touching across a seam"""
+        seams.append(np.unique(np.stack([a, b], axis=1), axis=0))
+
+    # first pass labels every tile with int64 labels unique across tiles,
+    # keeping the last image row of the tile row above and the last column
+    offsets = []
+    offset = 0
+    bottom = np.zeros(m, dtype=np.int64)
+    next_bottom = np.zeros(m, dtype=np.int64)
+    for r0, r1, c0, c1 in tiles:
+        if c0 == 0:
+            bottom, next_bottom = next_bottom, bottom
+        rows, starts, ends, run_labels = _label_runs(
+            np.asarray(image[r0:r1, c0:c1]), True, connectivity)
+        labeled = np.zeros((r1 - r0, c1 - c0), dtype=np.int64)
+        _paint_runs(labeled, rows, starts, ends, run_labels + offset)
+        offsets.append(offset)
+        offset += int(run_labels.max(initial=0))
+
+        # the row above reaches into the tiles up left and up right, which
+        # are already labeled, the column to the left stays within the tile rows
+        if r0 > 0:
+            a, b = max(c0 + lo, 0), min(c1 + hi, m)
+            edge = np.zeros(b - a, dtype=np.int64)
+            edge[c0 - a:c1 - a] = labeled[0]
+            stitch(*_seam_pairs(bottom[a:b], edge, range(lo, hi + 1)))
+        if c0 > 0:
+            stitch(*_seam_pairs(right, labeled[:, 0], left))
+        next_bottom[c0:c1] = labeled[-1]
+        right = labeled[:, -1]
+
+    # only labels on a seam can merge, so the equivalence table holds
+    # their ranks among the seam labels, keys[k - 1] is label k
+    seams = np.concatenate(seams)
+    keys = np.unique(seams)
+    equiv_table = UnionFind(len(keys) + 1)
+    equiv_table.union_many(*(np.searchsorted(keys, seams.T) + 1))
+    roots = keys[equiv_table.flatten()[1:] - 1]
+    merged = np.sort(keys[roots != keys])
+    count = offset - len(merged)
+
+    created = None
+    if out is None or isinstance(out, (str, os.PathLike)):
+        dtype = label_dtype(count, dtype)
+        if out is None:
+            fd, out = tempfile.mkstemp(suffix='.npy')
+            os.close(fd)
+        created = out
+    else:
+        label_dtype(count, out.dtype)
+
+    try:
+        if created is not None:
+            out = np.lib.format.open_memmap(created, mode='w+', dtype=dtype, shape=(n, m))
+        # second pass labels every tile again, points merged labels at their
+        # root and closes the gaps
+        for (r0, r1, c0, c1), offset in zip(tiles, offsets):
+            rows, starts, ends, run_labels = _label_runs(
+                np.asarray(image[r0:r1, c0:c1]), True, connectivity)
+            run_labels = run_labels + offset
+            if len(keys):
+                index = np.clip(np.searchsorted(keys, run_labels), 0, len(keys) - 1)
+                hit = keys[index] == run_labels
+                run_labels = np.where(hit, roots[index], run_labels)
+            labeled = np.zeros((r1 - r0, c1 - c0), dtype=out.dtype)
+            _paint_runs(labeled, rows, starts, ends,
+                        run_labels - np.searchsorted(merged, run_labels))
+            out[r0:r1, c0:c1] = labeled
+    except BaseException:
+        # a partial label map is of no use and can be gigabytes
+        if created is not None:
+            out = None
+            os.remove(created)
+        raise
+
+    if isinstance(out, np.memmap):
+        out.flush()
+    return set(range(count + 1)), out
+
+# (row, col) of the neighbors P2..P9 of a pixel, clockwise from the top. Bit
+# k of a neighbor code is P(k + 2)
+THINNING_NEIGHBORS = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+
+def _thinning_tables():
+    """Builds the deletion tables of every thinning method
+
+    Entry code of a table is True when a foreground pixel whose neighbors
+    P2..P9 are the bits of code gets deleted in that sub-iteration. Holt's
+    single table marks edge pixels instead, whether they are deleted also
+    depends on the edges next to them (see _holt_deletes)
+
+    Returns
+    * tables (dict) - method name to a bool array with one row per sub-iteration
+    """
+    tables = {'zhang-suen': np.zeros((2, 256), dtype=bool),
+              'guo-hall': np.zeros((2, 256), dtype=bool),
+              'holt': np.zeros((1, 256), dtype=bool)}
+    for code in range(256):
+        neighbors = [(code >> bit) & 1 for bit in range(8)]
+        p2, p3, p4, p5, p6, p7, p8, p9 = neighbors
+        # 0 -> 1 steps going around P2, P3, ..., P9, P2
+        transitions = sum(a == 0 and b == 1 for a, b in zip(neighbors, neighbors[1:] + neighbors[:1]))
+        removable = 2 <= sum(neighbors) <= 6 and transitions == 1
+        tables['zhang-suen'][0, code] = removable and p2 * p4 * p6 == 0 and p4 * p6 * p8 == 0
+        tables['zhang-suen'][1, code] = removable and p2 * p4 * p8 == 0 and p2 * p6 * p8 == 0
+        tables['holt'][0, code] = removable
+
+        # Guo-Hall counts 8-connected parts of the neighbors and how thick they are
+        parts = ((1 - p2) & (p3 | p4)) + ((1 - p4) & (p5 | p6)) + \
+                ((1 - p6) & (p7 | p8)) + ((1 - p8) & (p9 | p2))
+        thickness = min((p9 | p2) + (p3 | p4) + (p5 | p6) + (p7 | p8),
+                        (p2 | p3) + (p4 | p5) + (p6 | p7) + (p8 | p9))
+        simple = parts == 1 and 2 <= thickness <= 3
+        tables['guo-hall'][0, code] = simple and not ((p6 | p7 | (1 - p9)) & p8)
+        tables['guo-hall'][1, code] = simple and not ((p2 | p3 | (1 - p5)) & p4)
+    return tables
+
+THINNING_TABLES = _thinning_tables()
+
+def _holt_deletes(value, edge):
+    """Holt's one pass rule, an edge pixel stays when a neighbor edge covers it
+
+    Parameters
+    * value, edge (function) - (di, dj) to the foreground and edge masks of the
+      pixels at that offset from the checked ones
+    """
+    return edge(0, 0) & ~((edge(0, 1) & value(-1, 0) & value(1, 0)) |
+                          (edge(1, 0) & value(0, -1) & value(0, 1)) |
+                          (edge(0, 1) & edge(1, 1) & edge(1, 0)))
+
+def _neighbor_codes(padded):
+    """Neighbor code of every inner pixel of a bool matrix padded by one
+
+    Each neighbor is a shifted view of padded, so this is 8 shifts and ors
+    """
+    n, m = padded.shape[0] - 2, padded.shape[1] - 2
+    codes = np.zeros((n, m), dtype=np.uint8)
+    for bit, (di, dj) in enumerate(THINNING_NEIGHBORS):
+        codes |= padded[1 + di:n + 1 + di, 1 + dj:m + 1 + dj].view(np.uint8) << np.uint8(bit)
+    return codes
+
+def _skeleton_loop(image, deleted=None):
+    """Thins image pixel by pixel, checking the Zhang-Suen rules on every neighborhood"""
     H, W = image.shape
     image = np.pad(image, (1,1), mode='constant', constant_values=(0,0))
 
@@ -169,7 +1739,7 @@ def skeletonization(image):
         ])
     
     def get_transitions(neighbors):
-        n = neighbors + neighbors[0]
+        n = np.append(neighbors, neighbors[0]) # wraps around to P2
         count = 0
         for n1, n2 in zip(n, n[1:]):
             if n1 == 0 and n2 == 1:
@@ -180,8 +1750,8 @@ def skeletonization(image):
     changed_first = changed_second = [('flag', 'flag')]
     while changed_first or changed_second:
         changed_first = []
-        for i in range(1, H):
-            for j in range(1, W):
+        for i in range(1, H + 1):
+            for j in range(1, W + 1):
                 if image[i,j] == 1:
                     neighbors = get_neighbors(i, j)
                     if (2 <= len(neighbors[neighbors == 1]) <= 6 and
@@ -191,11 +1761,13 @@ def skeletonization(image):
                         changed_first.append((i, j))
         for i, j in changed_first:
             image[i, j] = 0
+        if deleted is not None:
+            deleted.append(np.array(changed_first, dtype=np.int32).reshape(-1, 2) - 1)
 
 
         changed_second = []
-        for i in range(1, H):
-            for j in range(1, W):
+        for i in range(1, H + 1):
+            for j in range(1, W + 1):
                 if image[i,j] == 1:
                     neighbors = get_neighbors(i, j)
                     if (2 <= len(neighbors[neighbors == 1]) <= 6 and
@@ -205,22 +1777,277 @@ def skeletonization(image):
                         changed_second.append((i, j))
         for i, j in changed_second:
             image[i, j] = 0       
+        if deleted is not None:
+            deleted.append(np.array(changed_second, dtype=np.int32).reshape(-1, 2) - 1)
+
+    return image[1:H + 1, 1:W + 1]
+
+def _skeleton_lut(image, method='zhang-suen', deleted=None):
+    """Thins image a whole sub-iteration at a time
+
+    Every pixel's neighbors are packed into a uint8 code, so each rule check is
+    one lookup in a 256 entry table and the deletions are one masked store
+    """
+    n, m = image.shape
+    # two rows and columns after the image so Holt can look at edges below and right
+    padded = np.zeros((n + 3, m + 3), dtype=bool)
+    padded[1:n + 1, 1:m + 1] = image == 1
+    inner = padded[1:n + 1, 1:m + 1]
+    edges = np.zeros_like(padded)
 
-    return image[1:H, 1:W] 
+    def shifted(array):
+        return lambda di, dj: array[1 + di:n + 1 + di, 1 + dj:m + 1 + dj]
+
+    changed = True
+    while changed:
+        changed = False
+        for table in THINNING_TABLES[method]:
+            delete = inner & table[_neighbor_codes(padded[:n + 2, :m + 2])]
+            if method == 'holt':
+                edges[1:n + 1, 1:m + 1] = delete
+                delete = _holt_deletes(shifted(padded), shifted(edges))
+            if deleted is not None:
+                deleted.append(np.argwhere(delete).astype(np.int32))
+            if delete.any():
+                inner[delete] = False
+                changed = True
+
+    return inner.astype(image.dtype)
+
+def _skeleton_frontier(image, method='zhang-suen', deleted=None):
+    """Thins image checking only pixels whose neighborhood may have changed
+
+    A pixel that fails a sub-iteration's rule keeps failing it until one of
+    its neighbors is deleted, so each sub-iteration only checks the contour
+    at first and the neighbors of deleted pixels after that. Work per
+    iteration follows the contour length instead of the image size
+    """
+    n, m = image.shape
+    w = m + 4
+    tables = THINNING_TABLES[method]
+    shifts = np.array([di * w + dj for di, dj in THINNING_NEIGHBORS])
+    # padded by two so Holt can look at the edges of the neighbors
+    foreground = np.zeros((n + 4) * w, dtype=bool)
+    foreground.reshape(n + 4, w)[2:-2, 2:-2] = image == 1
+    if method == 'holt':
+        # Holt's rule looks one pixel up and left and two down and right
+        reach = np.array([di * w + dj for di in range(-2, 2) for dj in range(-2, 2)])
+    else:
+        reach = shifts
+
+    def neighbor_codes(pos):
+        codes = np.zeros(len(pos), dtype=np.uint8)
+        for bit, shift in enumerate(shifts):
+            codes |= foreground[pos + shift].view(np.uint8) << np.uint8(bit)
+        return codes
+
+    def edge(pos):
+        return foreground[pos] & tables[0][neighbor_codes(pos)]
+
+    pixels = np.flatnonzero(foreground)
+    contour = pixels[neighbor_codes(pixels) != 255]
+    # pixels to check in the next pass of every sub-iteration
+    pending = [contour] * len(tables)
+    step = 0
+    while any(len(candidates) for candidates in pending):
+        candidates = pending[step]
+        candidates = candidates[foreground[candidates]]
+        if method == 'holt':
+            delete = candidates[_holt_deletes(
+                lambda di, dj: foreground[candidates + di * w + dj],
+                lambda di, dj: edge(candidates + di * w + dj))]
+        else:
+            delete = candidates[tables[step][neighbor_codes(candidates)]]
+        foreground[delete] = False
+        if deleted is not None:
+            rows, cols = np.divmod(delete, w)
+            deleted.append(np.stack([rows - 2, cols - 2], axis=1).astype(np.int32))
+
+        changed = (delete[:, None] + reach).ravel()
+        changed = np.unique(changed[foreground[changed]])
+        pending = [np.union1d(candidates, changed) for candidates in pending]
+        pending[step] = changed
+        step = (step + 1) % len(tables)
+
+    return foreground.reshape(n + 4, w)[2:-2, 2:-2].astype(image.dtype)
+
+def skeletonization(image, engine='loop', history=False, method='zhang-suen'):
+    '''Thins image using a parallel thinning algorithm, Zhang Suen's by default
+    
+    Parameters
+    * image (ndarray) - binary matrix with shape (H,W)
+    * engine (str) - 'loop' checks one pixel at a time, 'lut' checks a whole
+      sub-iteration with table lookups of neighbor codes and 'frontier' does
+      the lookups only for the contour and the neighbors of the last
+      deletions. All of them give identical output
+    * history (bool) - also returns the pixels deleted by every sub-iteration
+    * method (str) - 'zhang-suen', 'guo-hall' (usually a thinner skeleton) or
+      'holt' (one pass per iteration, deletions checked against the
+      neighbors' edges). 'loop' only runs 'zhang-suen'
+
+    Returns
+    * skeleton (ndarray) - thinned matrix with shape (H,W)
+    * history (list) - only with history, one int32 array of (row, col) per
+      sub-iteration up to the last one that deleted anything, see
+      thinning_frames to replay it
+    '''
+    if method not in THINNING_TABLES:
+        raise ValueError(f"unknown method '{method}'")
+
+    deleted = [] if history else None
+    if engine == 'lut':
+        skeleton = _skeleton_lut(image, method, deleted)
+    elif engine == 'frontier':
+        skeleton = _skeleton_frontier(image, method, deleted)
+    elif engine == 'loop':
+        if method != 'zhang-suen':
+            raise ValueError(f"engine 'loop' does not support method '{method}'")
+        skeleton = _skeleton_loop(image, deleted)
+    else:
+        raise ValueError(f"unknown engine '{engine}'")
+
+    if not history:
+        return skeleton
+    while deleted and not len(deleted[-1]):
+        deleted.pop()
+    return skeleton, deleted
+
+def thinning_frames(image, history):
+    """Replays a thinning from the history of skeletonization
+
+    Only one frame is rebuilt at a time, so memory doesn't grow with the
+    number of iterations
+
+    Parameters
+    * image (ndarray) - binary matrix with shape (H,W) that was thinned
+    * history (list) - deleted pixels of every sub-iteration
+
+    Yields
+    * frame (ndarray) - image itself, then the image after each sub-iteration
+    """
+    frame = image.copy()
+    yield frame.copy()
+    for deleted in history:
+        frame[deleted[:, 0], deleted[:, 1]] = 0
+        yield frame.copy()
+
+def _lower_envelope(f):
+    """Squared distance transform of f along its last axis
+
+    d[..., q] = min over p of (q - p)^2 + f[..., p], from the lower envelope of
+    the parabolas rooted at every p (Felzenszwalb-Huttenlocher), linear in the
+    line length. All lines are swept together one position at a time
+    """
+    if not f.size:
+        return f.astype(np.float64)
+    lines = f.reshape(-1, f.shape[-1]).astype(np.float64)
+    count, size = lines.shape
+    rows = np.arange(count)
+    # apexes of the parabolas on the envelope and where each one starts
+    apexes = np.zeros((count, size), dtype=np.int64)
+    starts = np.full((count, size + 1), np.inf)
+    starts[:, 0] = -np.inf
+    k = np.zeros(count, dtype=np.int64)
+    for q in range(1, size):
+        while True:
+            p = apexes[rows, k]
+            # where the parabola of q overtakes the last one on the envelope
+            cross = (lines[:, q] + q * q - lines[rows, p] - p * p) / (2 * (q - p))
+            hidden = cross <= starts[rows, k]
+            if not hidden.any():
+                break
+            k[hidden] -= 1
+        k += 1
+        apexes[rows, k] = q
+        starts[rows, k] = cross
+        starts[rows, k + 1] = np.inf
+
+    distances = np.empty_like(lines)
+    k[:] = 0
+    for q in range(size):
+        while True:
+            ahead = starts[rows, k + 1] < q
+            if not ahead.any():
+                break
+            k[ahead] += 1
+        p = apexes[rows, k]
+        distances[:, q] = (q - p) ** 2 + lines[rows, p]
+    return distances.reshape(f.shape)
+
+def _squared_distances(f):
+    """min over p of |x - p|^2 + f[p] for every pixel x, columns then rows"""
+    return _lower_envelope(_lower_envelope(f.T).T)
+
+def distance_transform(image):
+    """Exact euclidean distance from every pixel to the nearest background pixel
+
+    Pixels outside image count as background, so the distance is to the
+    boundary of each part. Linear time in the number of pixels
+
+    Parameters
+    * image (ndarray) - binary matrix with shape (H,W)
+
+    Returns
+    * distances (ndarray) - float matrix with shape (H,W), 0 on background
+    """
+    n, m = image.shape
+    # any finite value past the largest squared distance works as "no background here"
+    far = float((n + 2) ** 2 + (m + 2) ** 2)
+    f = np.zeros((n + 2, m + 2))
+    f[1:-1, 1:-1] = np.where(image == 1, far, 0.0)
+    return np.sqrt(_squared_distances(f)[1:-1, 1:-1])
+
+def medial_axis(image, engine='frontier', method='zhang-suen'):
+    """Skeleton of image with the distance to the boundary of every skeleton pixel
+
+    Parameters
+    * image (ndarray) - binary matrix with shape (H,W)
+    * engine, method (str) - thinning to use, see skeletonization
+
+    Returns
+    * skeleton (ndarray) - thinned matrix with shape (H,W)
+    * radius (ndarray) - float matrix with shape (H,W) holding distance_transform
+      on skeleton pixels and 0 elsewhere
+    """
+    skeleton = skeletonization(image, engine, method=method)
+    radius = np.where(skeleton == 1, distance_transform(image), 0.0)
+    return skeleton, radius
+
+def reconstruct_medial_axis(skeleton, radius):
+    """Rebuilds a shape as the union of the discs of its medial axis
+
+    A pixel is inside when it is closer than radius to some skeleton pixel.
+    That is a min of |x - s|^2 - radius[s]^2 over skeleton pixels s, the same
+    separable transform as distance_transform. Radii of every foreground pixel
+    give back the image exactly, a thinned skeleton loses some of the corners
+
+    Parameters
+    * skeleton (ndarray) - binary matrix with shape (H,W)
+    * radius (ndarray) - float matrix with shape (H,W), see medial_axis
+
+    Returns
+    * image (ndarray) - binary matrix with shape (H,W)
+    """
+    n, m = skeleton.shape
+    f = np.where(skeleton == 1, -np.square(radius, dtype=np.float64), float(n * n + m * m + 1))
+    # the tolerance keeps pixels at exactly radius, like the nearest background, outside
+    inside = _squared_distances(f) < -1e-6
+    return inside.astype(skeleton.dtype)
 
 def color_segmentations(labels, labeled_image):
     """Returns new image with unique colors for each object
     
+    Colors are kept in a dense table indexed by label, so the image is colored
+    with a single lookup. Consecutive labels (see compact) keep the table small
+
     Parameters
     * labels (set) - a set of all unique labels
     * labeled_image (ndarrray) - matrix with shape (H, W) where pos[i, j] = label
     """
-    n,m = labeled_image.shape
-    colors = {l: tuple(np.random.rand(3)) for l in labels}
-    colored = np.zeros(shape=(n, m, 3))
+    labels = np.fromiter(labels, dtype=np.int64, count=len(labels))
+    size = max(labels.max(initial=0), labeled_image.max(initial=0)) + 1
+    colors = np.zeros(shape=(size, 3))
+    colors[labels] = np.random.rand(len(labels), 3)
 
     colors[0] = (0, 0, 0)
-    for l, c in colors.items():
-        colored[labeled_image == l] = c
-
-    return colored
\ No newline at end of file
+    return colors[labeled_image]